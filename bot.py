@@ -1,27 +1,58 @@
 import os
+import time
+import asyncio
 import requests
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from itertools import zip_longest
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeoutError
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
+from telegram.ext import Application, BaseUpdateProcessor, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
 from telegram.request import HTTPXRequest
 from dotenv import load_dotenv
-from flask import Flask
-from threading import Thread
+from flask import Flask, jsonify
+from threading import Lock, Thread
 
 # Load environment variables
 load_dotenv()
 
 # API Configuration
 OPHIM_API_BASE = "https://ophim1.com/v1/api"
+# Danh sách mirror API, phân cách bằng dấu phẩy (mặc định hoặc khi để trống chỉ dùng OPHIM_API_BASE)
+OPHIM_API_MIRRORS = [url.strip() for url in os.getenv('OPHIM_API_MIRRORS', '').split(',') if url.strip()] or [OPHIM_API_BASE]
+OPHIM_SITE_URL = os.getenv('OPHIM_SITE_URL', 'https://ophim1.com').rstrip('/')  # Trang web dùng cho link gửi người dùng
+HEDGE_REQUESTS = os.getenv('HEDGE_REQUESTS', 'false').lower() in ('1', 'true', 'yes')  # Gửi request dự phòng khi mirror chậm
 BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 PROXY_URL = os.getenv('PROXY_URL', None)  # Optional proxy
+CACHE_TTL = int(os.getenv('CACHE_TTL', 300))  # Thời gian cache response API (giây)
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', 8))  # Số update chạy cùng lúc (tối thiểu 2)
+CALLBACK_RESERVED_SLOTS = int(os.getenv('CALLBACK_RESERVED_SLOTS', 2))  # Slot chỉ dành cho callback từ nút bấm
+MAX_PENDING_UPDATES = int(os.getenv('MAX_PENDING_UPDATES', 256))  # Số update tối đa đang chạy và chờ
+STARVATION_TIMEOUT = float(os.getenv('STARVATION_TIMEOUT', 5.0))  # Thời gian chờ tối đa trước khi được ưu tiên
+WARM_INTERVAL = int(os.getenv('WARM_INTERVAL', 60))  # Chu kỳ làm nóng cache (giây)
+WARM_TOP_K = int(os.getenv('WARM_TOP_K', 20))  # Số phim/từ khóa phổ biến nhất được làm nóng
+WARM_BUDGET = int(os.getenv('WARM_BUDGET', 30))  # Số request HTTP tối đa mỗi lượt làm nóng (tính cả failover, hedge)
+POPULARITY_HALF_LIFE = int(os.getenv('POPULARITY_HALF_LIFE', 3600))  # Chu kỳ bán rã lượt truy cập (giây)
+POPULARITY_MIN_COUNT = float(os.getenv('POPULARITY_MIN_COUNT', 1.0))  # Số lượt tối thiểu để được coi là phổ biến
+
+# Ngân sách request HTTP của context hiện tại ({'used': n, 'limit': m}), None nếu không giới hạn
+request_budget = ContextVar('request_budget', default=None)
 
 # Flask app for keep alive (for deployment on Render, etc.)
 app = Flask('')
 
+# Các nguồn số liệu hiển thị tại /metrics (tên -> hàm trả về dict)
+metrics_sources = {}
+
 @app.route('/')
 def home():
     return "Bot is alive!"
 
+@app.route('/metrics')
+def metrics():
+    """Trả về số liệu hoạt động của bot dưới dạng JSON"""
+    return jsonify({name: source() for name, source in metrics_sources.items()})
+
 def run_flask():
     """Chạy Flask server"""
     app.run(host='0.0.0.0', port=8080)
@@ -34,6 +65,479 @@ def keep_alive():
     print("✅ Flask web server started on http://0.0.0.0:8080")
     print("🔗 Use this URL for Uptime Robot to keep bot alive")
 
+class TTLCache:
+    """Cache đơn giản có thời hạn cho response từ API (an toàn khi dùng nhiều thread)"""
+    def __init__(self, ttl=CACHE_TTL, max_size=1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data = OrderedDict()  # key -> (thời điểm hết hạn, giá trị)
+        self._lock = Lock()
+    
+    def get(self, key):
+        """Lấy giá trị còn hạn, trả về None nếu không có hoặc đã hết hạn"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+    
+    def set(self, key, value):
+        """Lưu giá trị, loại bỏ mục cũ nhất khi cache đầy"""
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+    
+    def __contains__(self, key):
+        return self.get(key) is not None
+    
+    def expires_in(self, key):
+        """Số giây còn lại trước khi mục hết hạn, None nếu không có trong cache"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            remaining = entry[0] - time.monotonic()
+            return remaining if remaining > 0 else None
+
+class Mirror:
+    """Trạng thái sức khỏe của một mirror API Ophim"""
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.latency = None  # EWMA độ trễ (giây), None khi chưa có request nào
+        self.latency_updated = 0.0
+        self.last_attempt = None  # Lần cuối mirror thực sự được gọi, None nếu chưa bao giờ
+        self.error_rate = 0.0  # EWMA tỉ lệ lỗi
+        self.error_updated = time.monotonic()
+        self.latencies = deque(maxlen=100)  # Độ trễ gần đây để tính p95
+        self.requests = 0
+        self.errors = 0
+    
+    def current_error_rate(self, now, half_life):
+        """Tỉ lệ lỗi giảm dần theo thời gian để mirror đã hồi phục được dùng lại"""
+        return self.error_rate * 0.5 ** ((now - self.error_updated) / half_life)
+    
+    def p95(self, min_samples=20):
+        """Độ trễ p95 gần đây, None nếu chưa đủ mẫu"""
+        if len(self.latencies) < min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+class MirrorPool:
+    """Chọn mirror API tốt nhất theo độ trễ và tỉ lệ lỗi, tự chuyển mirror khi lỗi
+    
+    Mỗi request được gửi tới mirror có điểm thấp nhất (EWMA độ trễ nhân với
+    mức phạt theo tỉ lệ lỗi). Khi bật hedge, nếu mirror đầu tiên chưa trả lời
+    sau p95 của nó thì gửi thêm một request tới mirror kế tiếp và lấy kết quả
+    về trước. Mirror lâu không được dùng chỉ được thăm dò ngoài luồng bằng
+    probe_stale(), không bao giờ bằng request của người dùng.
+    """
+    def __init__(self, base_urls, hedge=HEDGE_REQUESTS, timeout=10, alpha=0.2,
+                 error_penalty=10, error_half_life=60, probe_after=60,
+                 probe_timeout=3, probe_path='/danh-sach/phim-moi-cap-nhat'):
+        if not base_urls:
+            raise ValueError("Cần ít nhất một mirror API")
+        
+        self.mirrors = [Mirror(url) for url in base_urls]
+        self.hedge = hedge and len(self.mirrors) > 1
+        self.timeout = timeout
+        self.alpha = alpha
+        self.error_penalty = error_penalty
+        self.error_half_life = error_half_life
+        self.probe_after = probe_after
+        self.probe_timeout = probe_timeout
+        self.probe_path = probe_path
+        self.headers = {"accept": "application/json"}
+        self._lock = Lock()
+        # Mỗi request hedge cần tối đa 2 thread; thêm 1 cho tác vụ làm nóng cache.
+        # Executor đủ lớn để thời gian chờ p95 không tính cả thời gian xếp hàng chờ thread
+        workers = 2 * (MAX_CONCURRENT_UPDATES + 1)
+        self._executor = ThreadPoolExecutor(max_workers=workers) if self.hedge else None
+    
+    def _spend_request(self):
+        """Trừ một request khỏi ngân sách của context hiện tại, False nếu đã hết"""
+        budget = request_budget.get()
+        if budget is None:
+            return True
+        if budget['used'] >= budget['limit']:
+            return False
+        budget['used'] += 1
+        return True
+    
+    def ranked(self):
+        """Danh sách mirror từ tốt nhất tới kém nhất
+        
+        Mirror chưa có độ trễ (chưa thử hoặc chỉ toàn lỗi) được coi như chậm
+        bằng timeout; khi điểm bằng nhau giữ nguyên thứ tự cấu hình.
+        """
+        now = time.monotonic()
+        
+        def score(mirror):
+            latency = mirror.latency if mirror.latency is not None else self.timeout
+            error_rate = mirror.current_error_rate(now, self.error_half_life)
+            return latency * (1 + self.error_penalty * error_rate)
+        
+        with self._lock:
+            return sorted(self.mirrors, key=score)
+    
+    def probe_stale(self):
+        """Thăm dò các mirror không được gọi quá probe_after giây với timeout ngắn
+        
+        Chạy từ JobQueue, nên mirror chết chỉ làm chậm tác vụ nền chứ không làm
+        người dùng phải đợi. Kết quả cập nhật số liệu như request thường.
+        """
+        now = time.monotonic()
+        with self._lock:
+            stale = [
+                mirror for mirror in self.mirrors
+                if mirror.last_attempt is None or now - mirror.last_attempt >= self.probe_after
+            ]
+        
+        for mirror in stale:
+            try:
+                self._request(mirror, self.probe_path, {'page': 1}, timeout=self.probe_timeout)
+            except requests.RequestException as e:
+                print(f"Probe {mirror.base_url} failed: {e}")
+        return len(stale)
+    
+    def _record(self, mirror, elapsed=None):
+        """Cập nhật EWMA độ trễ và tỉ lệ lỗi (elapsed=None nghĩa là lỗi)"""
+        now = time.monotonic()
+        with self._lock:
+            mirror.requests += 1
+            error_rate = mirror.current_error_rate(now, self.error_half_life)
+            failed = 1.0 if elapsed is None else 0.0
+            mirror.error_rate = error_rate + self.alpha * (failed - error_rate)
+            mirror.error_updated = now
+            
+            if elapsed is None:
+                mirror.errors += 1
+                return
+            
+            # Số liệu cũ của mirror lâu không dùng không còn đúng, lấy mẫu mới làm gốc
+            stale = now - mirror.latency_updated >= self.probe_after
+            mirror.latencies.append(elapsed)
+            if mirror.latency is None or stale:
+                mirror.latency = elapsed
+            else:
+                mirror.latency += self.alpha * (elapsed - mirror.latency)
+            mirror.latency_updated = now
+    
+    def _request(self, mirror, path, params, timeout=None):
+        started = time.monotonic()
+        with self._lock:
+            mirror.last_attempt = started
+        try:
+            response = requests.get(
+                f"{mirror.base_url}{path}",
+                params=params,
+                headers=self.headers,
+                timeout=timeout or self.timeout
+            )
+            # 404 là câu trả lời hợp lệ (không có phim); 429, 403, 5xx... là mirror có vấn đề
+            if response.status_code not in (200, 404):
+                raise requests.HTTPError(f"{response.status_code} from {mirror.base_url}", response=response)
+        except requests.RequestException:
+            self._record(mirror)
+            raise
+        
+        self._record(mirror, time.monotonic() - started)
+        return response
+    
+    def _hedged_request(self, primary, backup, path, params, attempted):
+        """Gửi tới primary, sau p95 chưa xong thì gửi thêm tới backup"""
+        primary_future = self._executor.submit(self._request, primary, path, params)
+        try:
+            return primary_future.result(timeout=primary.p95())
+        except FutureTimeoutError:
+            pass
+        
+        if not self._spend_request():
+            return primary_future.result()
+        
+        attempted.add(backup.base_url)
+        backup_future = self._executor.submit(self._request, backup, path, params)
+        last_error = None
+        for future in as_completed([primary_future, backup_future]):
+            try:
+                return future.result()
+            except requests.RequestException as e:
+                last_error = e
+        raise last_error
+    
+    def get(self, path, params=None):
+        """Gửi GET tới mirror tốt nhất, lần lượt thử mirror khác nếu lỗi"""
+        ranked = self.ranked()
+        attempted = set()
+        last_error = None
+        
+        for index, mirror in enumerate(ranked):
+            if mirror.base_url in attempted:
+                continue
+            if not self._spend_request():
+                break
+            attempted.add(mirror.base_url)
+            
+            backup = ranked[index + 1] if index + 1 < len(ranked) else None
+            try:
+                if self.hedge and backup and mirror.p95() is not None:
+                    return self._hedged_request(mirror, backup, path, params, attempted)
+                return self._request(mirror, path, params)
+            except requests.RequestException as e:
+                print(f"Mirror {mirror.base_url} failed: {e}")
+                last_error = e
+        
+        if last_error is None:
+            raise requests.RequestException(f"Hết ngân sách request cho {path}")
+        raise last_error
+    
+    def stats(self):
+        """Số liệu độ trễ và tỉ lệ lỗi của từng mirror"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                mirror.base_url: {
+                    'latency_ewma': round(mirror.latency, 3) if mirror.latency is not None else None,
+                    'latency_p95': round(mirror.p95(), 3) if mirror.p95() is not None else None,
+                    'error_rate': round(mirror.current_error_rate(now, self.error_half_life), 3),
+                    'requests': mirror.requests,
+                    'errors': mirror.errors,
+                }
+                for mirror in self.mirrors
+            }
+
+class PopularityTracker:
+    """Đếm tần suất truy cập bằng count-min sketch có suy giảm theo thời gian
+    
+    Sketch ước lượng số lượt của mọi key với bộ nhớ cố định, còn danh sách
+    ứng viên (tối đa capacity key) giữ lại các key có ước lượng cao nhất.
+    """
+    def __init__(self, width=2048, depth=4, capacity=64, min_count=POPULARITY_MIN_COUNT):
+        self.width = width
+        self.depth = depth
+        self.capacity = capacity
+        self.min_count = min_count
+        self._rows = [[0.0] * width for _ in range(depth)]
+        self._candidates = {}  # key -> ước lượng số lượt truy cập
+        self._lock = Lock()
+    
+    def _cells(self, key):
+        return [(row, hash((row, key)) % self.width) for row in range(self.depth)]
+    
+    def record(self, key):
+        """Ghi nhận một lượt truy cập key"""
+        with self._lock:
+            estimate = None
+            for row, col in self._cells(key):
+                self._rows[row][col] += 1
+                value = self._rows[row][col]
+                estimate = value if estimate is None else min(estimate, value)
+            
+            if key in self._candidates or len(self._candidates) < self.capacity:
+                self._candidates[key] = estimate
+                return
+            
+            coldest = min(self._candidates, key=self._candidates.get)
+            if estimate > self._candidates[coldest]:
+                del self._candidates[coldest]
+                self._candidates[key] = estimate
+    
+    def estimate(self, key):
+        """Ước lượng số lượt truy cập (có thể cao hơn thực tế, không bao giờ thấp hơn)"""
+        with self._lock:
+            return min(self._rows[row][col] for row, col in self._cells(key))
+    
+    def decay(self, factor):
+        """Giảm toàn bộ bộ đếm theo hệ số, loại ứng viên đã rơi xuống dưới min_count"""
+        with self._lock:
+            for counts in self._rows:
+                for col in range(self.width):
+                    counts[col] *= factor
+            for key in list(self._candidates):
+                self._candidates[key] *= factor
+                if self._candidates[key] < self.min_count:
+                    del self._candidates[key]
+    
+    def seed(self, keys):
+        """Thêm key làm ứng viên với số lượt tối thiểu (dùng khi chưa có số liệu, ví dụ sau khi khởi động lại)"""
+        with self._lock:
+            for key in keys:
+                if len(self._candidates) >= self.capacity:
+                    break
+                self._candidates.setdefault(key, self.min_count)
+    
+    def forget(self, key):
+        """Bỏ key khỏi danh sách ứng viên (ví dụ khi API không trả về kết quả)"""
+        with self._lock:
+            self._candidates.pop(key, None)
+    
+    def top(self, k):
+        """Danh sách k key phổ biến nhất (ít nhất min_count lượt) kèm ước lượng, giảm dần"""
+        with self._lock:
+            ranked = sorted(
+                (item for item in self._candidates.items() if item[1] >= self.min_count),
+                key=lambda item: item[1],
+                reverse=True
+            )
+        return ranked[:k]
+
+class PriorityUpdateProcessor(BaseUpdateProcessor):
+    """Xử lý update theo mức ưu tiên thay vì theo thứ tự đến
+    
+    Mức 0: callback từ inline button (rẻ, người dùng cần phản hồi ngay)
+    Mức 1: công việc không cần gọi API (cache hit, lệnh tĩnh)
+    Mức 2: tìm kiếm phải gọi API Ophim
+    
+    PTB giới hạn số update được nhận cùng lúc (đang chạy + đang chờ) bằng
+    max_pending; trong số đó tối đa `workers` update được chạy thật sự.
+    `callback_reserved` slot chỉ dành cho callback, nên nút bấm (kể cả
+    query.answer()) không phải đợi các tìm kiếm đang chiếm hết slot.
+    Update chờ quá starvation_timeout giây sẽ được xử lý trước bất kể mức ưu tiên.
+    """
+    TIER_CALLBACK = 0
+    TIER_CACHED = 1
+    TIER_UPSTREAM = 2
+    TIER_NAMES = ('callback', 'cached', 'upstream')
+    
+    def __init__(self, classify, workers=MAX_CONCURRENT_UPDATES,
+                 callback_reserved=CALLBACK_RESERVED_SLOTS, max_pending=MAX_PENDING_UPDATES,
+                 starvation_timeout=STARVATION_TIMEOUT):
+        # Với ít hơn 2 slot, các update luôn chạy tuần tự và mức ưu tiên không có tác dụng
+        if workers < 2:
+            raise ValueError("MAX_CONCURRENT_UPDATES phải lớn hơn hoặc bằng 2")
+        if not 1 <= callback_reserved < workers:
+            raise ValueError("CALLBACK_RESERVED_SLOTS phải từ 1 tới MAX_CONCURRENT_UPDATES - 1")
+        if max_pending < workers:
+            raise ValueError("MAX_PENDING_UPDATES phải lớn hơn hoặc bằng MAX_CONCURRENT_UPDATES")
+        
+        super().__init__(max_pending)
+        self.classify = classify
+        self.workers = workers
+        self.callback_reserved = callback_reserved
+        self.starvation_timeout = starvation_timeout
+        self._running = [0 for _ in self.TIER_NAMES]
+        self._queues = [deque() for _ in self.TIER_NAMES]  # mỗi phần tử: (thời điểm vào hàng, future)
+        self._stats = [
+            {'dispatched': 0, 'promoted': 0, 'max_depth': 0, 'total_wait': 0.0}
+            for _ in self.TIER_NAMES
+        ]
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        pass
+    
+    async def do_process_update(self, update, coroutine):
+        """Chờ tới lượt theo mức ưu tiên rồi mới xử lý update"""
+        tier = self.classify(update)
+        try:
+            await self._acquire(tier)
+        except asyncio.CancelledError:
+            coroutine.close()
+            raise
+        
+        try:
+            await coroutine
+        finally:
+            self._release(tier)
+    
+    async def _acquire(self, tier):
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (time.monotonic(), waiter)
+        queue = self._queues[tier]
+        queue.append(entry)
+        self._stats[tier]['max_depth'] = max(self._stats[tier]['max_depth'], len(queue))
+        self._dispatch()
+        
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Đã được cấp slot nhưng bị hủy, trả slot lại cho update khác
+                self._release(tier)
+            elif entry in queue:
+                queue.remove(entry)
+            raise
+    
+    def _release(self, tier):
+        self._running[tier] -= 1
+        self._dispatch()
+    
+    def _can_start(self, tier):
+        """Kiểm tra còn slot cho mức ưu tiên này không (callback được dùng cả slot dành riêng)"""
+        running = sum(self._running)
+        if running >= self.workers:
+            return False
+        if tier == self.TIER_CALLBACK:
+            return True
+        return running - self._running[self.TIER_CALLBACK] < self.workers - self.callback_reserved
+    
+    def _dispatch(self):
+        """Cấp slot trống cho các update đang chờ theo thứ tự ưu tiên"""
+        while True:
+            tier = self._next_tier()
+            if tier is None:
+                return
+            
+            enqueued_at, waiter = self._queues[tier].popleft()
+            if waiter.done():
+                # Task đã bị hủy trước khi tới lượt
+                continue
+            
+            self._running[tier] += 1
+            stats = self._stats[tier]
+            stats['dispatched'] += 1
+            stats['total_wait'] += time.monotonic() - enqueued_at
+            waiter.set_result(None)
+    
+    def _next_tier(self):
+        """Chọn hàng đợi tiếp theo, ưu tiên update đã chờ quá lâu để tránh bị bỏ đói"""
+        now = time.monotonic()
+        eligible = [
+            tier for tier, queue in enumerate(self._queues)
+            if queue and self._can_start(tier)
+        ]
+        starving = [
+            (self._queues[tier][0][0], tier) for tier in eligible
+            if now - self._queues[tier][0][0] >= self.starvation_timeout
+        ]
+        if starving:
+            _, tier = min(starving)
+            if any(self._queues[higher] for higher in range(tier)):
+                self._stats[tier]['promoted'] += 1
+            return tier
+        
+        return eligible[0] if eligible else None
+    
+    def stats(self):
+        """Số liệu độ sâu hàng đợi và thời gian chờ theo từng mức ưu tiên"""
+        result = {
+            'running': sum(self._running),
+            'workers': self.workers,
+            'callback_reserved': self.callback_reserved,
+            'max_pending': self.max_concurrent_updates,
+        }
+        for tier, name in enumerate(self.TIER_NAMES):
+            stats = self._stats[tier]
+            waited = stats['dispatched'] or 1
+            result[name] = {
+                'running': self._running[tier],
+                'depth': len(self._queues[tier]),
+                'max_depth': stats['max_depth'],
+                'dispatched': stats['dispatched'],
+                'promoted': stats['promoted'],
+                'avg_wait': round(stats['total_wait'] / waited, 3),
+            }
+        return result
+
 class MovieBot:
     def __init__(self):
         # Tạo request với timeout dài hơn và proxy (nếu có)
@@ -46,8 +550,27 @@ class MovieBot:
             proxy=PROXY_URL         # Sử dụng proxy nếu có
         )
         
+        # Cache response API và bộ lập lịch ưu tiên cho update
+        self.cache = TTLCache()
+        self.mirrors = MirrorPool(OPHIM_API_MIRRORS)
+        self.popularity = PopularityTracker()
+        self.warm_stats = {'runs': 0, 'last_refreshed': 0, 'last_requests': 0, 'last_duration': 0.0}
+        self.scheduler = PriorityUpdateProcessor(self.classify_update)
+        # Mỗi update đang chạy có sẵn một thread để gọi API, không dùng chung
+        # thread pool mặc định (chỉ min(32, số CPU + 4) thread) của event loop
+        self.executor = ThreadPoolExecutor(max_workers=self.scheduler.workers)
+        metrics_sources['scheduler'] = self.scheduler.stats
+        metrics_sources['mirrors'] = self.mirrors.stats
+        metrics_sources['cache_warmer'] = self.cache_warmer_stats
+        
         # Xây dựng application với request tùy chỉnh
-        self.app = Application.builder().token(BOT_TOKEN).request(request).build()
+        self.app = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .request(request)
+            .concurrent_updates(self.scheduler)
+            .build()
+        )
         
         # Danh sách các danh mục phổ biến
         self.categories = {
@@ -58,7 +581,15 @@ class MovieBot:
             '🎬 Phim viện tưởng': 'phim-vien-tuong',
             '🍿 TV Shows': 'tv-shows'
         }
+        
+        # Hàm gọi API tương ứng với từng loại key trong cache
+        self.fetchers = {
+            'search': self.fetch_search_results,
+            'category': self.fetch_movies_by_category,
+            'movie': self.fetch_movie_details
+        }
         self.setup_handlers()
+        self.setup_jobs()
     
     def setup_handlers(self):
         """Thiết lập các handler cho bot"""
@@ -68,6 +599,142 @@ class MovieBot:
         self.app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.search_movie))
         self.app.add_handler(CallbackQueryHandler(self.button_callback))
     
+    def setup_jobs(self):
+        """Thiết lập các tác vụ chạy định kỳ"""
+        if self.app.job_queue is None:
+            print("⚠️  JobQueue không khả dụng, bỏ qua làm nóng cache và thăm dò mirror")
+            print("   Cài đặt: pip install \"python-telegram-bot[job-queue]\"")
+            return
+        
+        self.app.job_queue.run_repeating(self.warm_cache, interval=WARM_INTERVAL, first=5)
+        if len(self.mirrors.mirrors) > 1:
+            self.app.job_queue.run_repeating(self.probe_mirrors, interval=self.mirrors.probe_after / 2, first=1)
+    
+    async def probe_mirrors(self, context: ContextTypes.DEFAULT_TYPE):
+        """Thăm dò các mirror lâu không được dùng để số liệu độ trễ không bị cũ"""
+        await asyncio.to_thread(self.mirrors.probe_stale)
+    
+    async def warm_cache(self, context: ContextTypes.DEFAULT_TYPE):
+        """Làm mới trước các mục cache phổ biến sắp hết hạn hoặc chưa có"""
+        started = time.monotonic()
+        self.popularity.decay(0.5 ** (WARM_INTERVAL / POPULARITY_HALF_LIFE))
+        
+        # Ngân sách tính theo request HTTP thật sự gửi đi (asyncio.to_thread sao chép context)
+        budget = {'used': 0, 'limit': WARM_BUDGET}
+        token = request_budget.set(budget)
+        try:
+            # Trang đầu của các danh mục luôn được làm nóng, sau đó tới phim/từ khóa phổ biến
+            category_keys = [('category', slug, 1) for slug in self.categories.values()]
+            refreshed = await self._warm_keys(category_keys, budget)
+            
+            # Sau khi khởi động lại chưa có số liệu phổ biến, lấy phim mới ở trang đầu các danh mục
+            if not self.popularity.top(1):
+                self.seed_popularity(category_keys)
+            
+            hot_keys = [key for key, _ in self.popularity.top(WARM_TOP_K) if key not in category_keys]
+            refreshed += await self._warm_keys(hot_keys, budget)
+        finally:
+            request_budget.reset(token)
+        
+        self.warm_stats['runs'] += 1
+        self.warm_stats['last_refreshed'] = refreshed
+        self.warm_stats['last_requests'] = budget['used']
+        self.warm_stats['last_duration'] = round(time.monotonic() - started, 3)
+    
+    async def _warm_keys(self, keys, budget):
+        """Làm mới các key sắp hết hạn trong giới hạn ngân sách, trả về số key đã làm mới"""
+        refreshed = 0
+        for key in keys:
+            if budget['used'] >= budget['limit']:
+                break
+            
+            # Chỉ làm mới mục sẽ hết hạn trước hai lượt chạy tiếp theo
+            remaining = self.cache.expires_in(key)
+            if remaining is not None and remaining > 2 * WARM_INTERVAL:
+                continue
+            
+            try:
+                value = await asyncio.to_thread(self.fetchers[key[0]], *key[1:])
+            except requests.RequestException as e:
+                # Upstream lỗi hoặc hết ngân sách: giữ key để thử lại lượt sau
+                print(f"Cache warm failed for {key}: {e}")
+                continue
+            
+            if value:
+                self.cache.set(key, value)
+                refreshed += 1
+            else:
+                # API trả lời nhưng không có kết quả, không làm nóng lại key này nữa
+                self.popularity.forget(key)
+        return refreshed
+    
+    def seed_popularity(self, category_keys):
+        """Đưa phim ở trang đầu các danh mục (xen kẽ giữa các danh mục) vào danh sách phổ biến"""
+        pages = [self.cache.get(key) or [] for key in category_keys]
+        slugs = []
+        for items in zip_longest(*pages):
+            for movie in items:
+                slug = movie.get('slug') if movie else None
+                if slug and slug not in slugs:
+                    slugs.append(slug)
+        self.popularity.seed([('movie', slug) for slug in slugs[:WARM_TOP_K]])
+    
+    def cache_warmer_stats(self):
+        """Số liệu làm nóng cache và các key phổ biến nhất"""
+        top = [
+            {'key': '/'.join(str(part) for part in key), 'hits': round(hits, 1)}
+            for key, hits in self.popularity.top(WARM_TOP_K)
+        ]
+        return dict(self.warm_stats, budget=WARM_BUDGET, top=top)
+    
+    def classify_update(self, update):
+        """Xác định mức ưu tiên của update cho PriorityUpdateProcessor"""
+        if not isinstance(update, Update):
+            return PriorityUpdateProcessor.TIER_UPSTREAM
+        
+        if update.callback_query:
+            return PriorityUpdateProcessor.TIER_CALLBACK
+        
+        message = update.message
+        if message and message.text:
+            text = message.text.strip()
+            # Lệnh như /start, /help không cần gọi API
+            if text.startswith('/') or ('search', text.lower()) in self.cache:
+                return PriorityUpdateProcessor.TIER_CACHED
+        
+        return PriorityUpdateProcessor.TIER_UPSTREAM
+    
+    async def run_cached(self, key, func, *args):
+        """Gọi func(*args) từ handler: cache hit trả về ngay trên event loop,
+        còn lại chạy trong executor của bot để không chặn event loop"""
+        value = self.cache.get(key)
+        if value is not None:
+            self.popularity.record(key)
+            return value
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+    
+    def cached(self, key, fetch, empty=None):
+        """Lấy dữ liệu từ cache, gọi fetch() và lưu lại nếu chưa có
+        
+        Các hàm fetch_* ném RequestException khi upstream lỗi để phân biệt với
+        trường hợp API trả lời nhưng không có kết quả; khi đó trả về `empty`
+        và vẫn giữ key trong danh sách phổ biến.
+        """
+        self.popularity.record(key)
+        value = self.cache.get(key)
+        if value is None:
+            try:
+                value = fetch()
+            except requests.RequestException as e:
+                print(f"Upstream error for {key}: {e}")
+                return empty
+            if value:
+                self.cache.set(key, value)
+            else:
+                # Kết quả rỗng không được cache nên cũng không đáng làm nóng
+                self.popularity.forget(key)
+        return value
+    
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Xử lý lệnh /start"""
         welcome_text = """
@@ -129,16 +796,18 @@ Hãy gửi tên phim để bắt đầu tìm kiếm! 🍿
         )
     
     def search_movies_api(self, keyword):
+        """Tìm kiếm phim (có cache)"""
+        return self.cached(('search', keyword.lower()), lambda: self.fetch_search_results(keyword), empty=[])
+    
+    def fetch_search_results(self, keyword):
         """Tìm kiếm phim qua API"""
         try:
             # Sử dụng API tìm kiếm chính thức
-            url = f"{OPHIM_API_BASE}/tim-kiem"
             params = {
                 'keyword': keyword
             }
-            headers = {"accept": "application/json"}
             
-            response = requests.get(url, params=params, headers=headers, timeout=10)
+            response = self.mirrors.get('/tim-kiem', params=params)
             
             if response.status_code == 200:
                 data = response.json()
@@ -154,19 +823,23 @@ Hãy gửi tên phim để bắt đầu tìm kiếm! 🍿
                         return self.search_by_slug(keyword)
             
             return []
+        except requests.RequestException:
+            raise
         except Exception as e:
             print(f"Error searching movies: {e}")
             return []
     
     def get_movies_by_category(self, slug, page=1):
+        """Lấy danh sách phim theo danh mục (có cache)"""
+        return self.cached(('category', slug, page), lambda: self.fetch_movies_by_category(slug, page), empty=[])
+    
+    def fetch_movies_by_category(self, slug, page=1):
         """Lấy danh sách phim theo bộ lọc (thể loại, quốc gia, etc.)"""
         try:
             # API lấy danh sách theo slug
-            url = f"{OPHIM_API_BASE}/danh-sach/{slug}"
             params = {'page': page}
-            headers = {"accept": "application/json"}
             
-            response = requests.get(url, params=params, headers=headers, timeout=10)
+            response = self.mirrors.get(f"/danh-sach/{slug}", params=params)
             
             if response.status_code == 200:
                 data = response.json()
@@ -175,6 +848,8 @@ Hãy gửi tên phim để bắt đầu tìm kiếm! 🍿
                     return data['data'].get('items', [])
             
             return []
+        except requests.RequestException:
+            raise
         except Exception as e:
             print(f"Error getting movies by category: {e}")
             return []
@@ -184,10 +859,7 @@ Hãy gửi tên phim để bắt đầu tìm kiếm! 🍿
         try:
             # Chuyển keyword thành slug format (lowercase, replace space with -)
             slug = keyword.lower().replace(' ', '-')
-            url = f"{OPHIM_API_BASE}/phim/{slug}"
-            headers = {"accept": "application/json"}
-            
-            response = requests.get(url, headers=headers, timeout=10)
+            response = self.mirrors.get(f"/phim/{slug}")
             if response.status_code == 200:
                 data = response.json()
                 if data.get('status') == 'success' and 'data' in data:
@@ -196,16 +868,20 @@ Hãy gửi tên phim để bắt đầu tìm kiếm! 🍿
                         return [item]
             
             return []
+        except requests.RequestException:
+            raise
         except Exception as e:
             print(f"Error searching by slug: {e}")
             return []
     
     def get_movie_details(self, slug):
+        """Lấy chi tiết phim theo slug (có cache)"""
+        return self.cached(('movie', slug), lambda: self.fetch_movie_details(slug))
+    
+    def fetch_movie_details(self, slug):
         """Lấy chi tiết phim theo slug"""
         try:
-            url = f"{OPHIM_API_BASE}/phim/{slug}"
-            headers = {"accept": "application/json"}
-            response = requests.get(url, headers=headers, timeout=10)
+            response = self.mirrors.get(f"/phim/{slug}")
             
             if response.status_code == 200:
                 data = response.json()
@@ -215,6 +891,8 @@ Hãy gửi tên phim để bắt đầu tìm kiếm! 🍿
                 print(f"Movie not found: {slug}")
             
             return None
+        except requests.RequestException:
+            raise
         except Exception as e:
             print(f"Error getting movie details: {e}")
             return None
@@ -296,7 +974,7 @@ Hãy gửi tên phim để bắt đầu tìm kiếm! 🍿
         # Link chi tiết phim trên Ophim
         slug = movie.get('slug', '')
         if slug:
-            ophim_link = f"https://ophim1.com/phim/{slug}"
+            ophim_link = f"{OPHIM_SITE_URL}/phim/{slug}"
             links.append(('Xem trên Ophim', ophim_link))
         
         # Link poster
@@ -396,7 +1074,7 @@ Hãy gửi tên phim để bắt đầu tìm kiếm! 🍿
         processing_msg = await update.message.reply_text(f"🔍 Đang tìm kiếm phim '{keyword}'...")
         
         # Tìm kiếm phim
-        movies = self.search_movies_api(keyword)
+        movies = await self.run_cached(('search', keyword.lower()), self.search_movies_api, keyword)
         
         if not movies:
             await processing_msg.edit_text(
@@ -446,7 +1124,7 @@ Hãy gửi tên phim để bắt đầu tìm kiếm! 🍿
         if callback_data.startswith('detail_'):
             # Hiển thị chi tiết phim
             slug = callback_data.replace('detail_', '')
-            movie = self.get_movie_details(slug)
+            movie = await self.run_cached(('movie', slug), self.get_movie_details, slug)
             
             if movie:
                 detail_text = self.format_movie_info(movie, show_full=True)
@@ -488,7 +1166,7 @@ Hãy gửi tên phim để bắt đầu tìm kiếm! 🍿
         elif callback_data.startswith('links_'):
             # Hiển thị các link liên quan
             slug = callback_data.replace('links_', '')
-            movie = self.get_movie_details(slug)
+            movie = await self.run_cached(('movie', slug), self.get_movie_details, slug)
             
             if movie:
                 # Hiển thị menu chọn: Link cơ bản hoặc Link video
@@ -527,7 +1205,7 @@ Hãy gửi tên phim để bắt đầu tìm kiếm! 🍿
             slug = '_'.join(parts[:-1])
             server_index = int(parts[-1])
             
-            movie = self.get_movie_details(slug)
+            movie = await self.run_cached(('movie', slug), self.get_movie_details, slug)
             
             if movie:
                 links_text, total_servers = self.format_episode_links_text(movie, server_index)
@@ -567,7 +1245,7 @@ Hãy gửi tên phim để bắt đầu tìm kiếm! 🍿
         elif callback_data.startswith('basic_'):
             # Hiển thị các link cơ bản (poster, trailer, etc)
             slug = callback_data.replace('basic_', '')
-            movie = self.get_movie_details(slug)
+            movie = await self.run_cached(('movie', slug), self.get_movie_details, slug)
             
             if movie:
                 links = self.get_movie_links(movie)
@@ -607,7 +1285,7 @@ Hãy gửi tên phim để bắt đầu tìm kiếm! 🍿
             
             await query.message.reply_text(f"🔍 Đang tải {category_name}...")
             
-            movies = self.get_movies_by_category(slug)
+            movies = await self.run_cached(('category', slug, 1), self.get_movies_by_category, slug)
             
             if not movies:
                 await query.message.reply_text(
@@ -671,6 +1349,9 @@ Hãy gửi tên phim để bắt đầu tìm kiếm! 🍿
         print("🤖 Bot đang khởi động...")
         if PROXY_URL:
             print(f"🌐 Sử dụng proxy: {PROXY_URL}")
+        print(f"🪞 Mirror API: {', '.join(OPHIM_API_MIRRORS)}")
+        if self.mirrors.hedge:
+            print("⚡ Bật gửi request dự phòng (hedge) khi mirror chậm")
         print(f"⏱️  Timeout: 30 giây (tăng để tránh lỗi connection)")
         print(f"🚀 Bot đã sẵn sàng! Bắt đầu polling...")
         self.app.run_polling()
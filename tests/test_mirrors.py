@@ -0,0 +1,145 @@
+import time
+
+import pytest
+import requests
+
+import bot
+from bot import MirrorPool, request_budget
+
+
+class FakeResponse:
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+
+
+class FakeUpstream:
+    """Giả lập các mirror: host -> (độ trễ, mã trạng thái hoặc exception)"""
+    def __init__(self, **hosts):
+        self.hosts = hosts
+        self.calls = []
+    
+    def get(self, url, params=None, headers=None, timeout=None):
+        host = url.split('/')[2]
+        self.calls.append((host, timeout))
+        delay, outcome = self.hosts[host]
+        time.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return FakeResponse(outcome)
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    fake = FakeUpstream()
+    monkeypatch.setattr(bot.requests, 'get', fake.get)
+    return fake
+
+
+def make_pool(*hosts, **kwargs):
+    return MirrorPool([f"https://{host}/v1/api" for host in hosts], **kwargs)
+
+
+def test_fails_over_to_next_mirror_on_connection_error(upstream):
+    upstream.hosts = {'a': (0, requests.ConnectionError('down')), 'b': (0, 200)}
+    pool = make_pool('a', 'b')
+    
+    assert pool.get('/phim/x').status_code == 200
+    assert [host for host, _ in upstream.calls] == ['a', 'b']
+    
+    stats = pool.stats()
+    assert stats['https://a/v1/api']['errors'] == 1
+    assert stats['https://b/v1/api']['errors'] == 0
+
+
+@pytest.mark.parametrize('status', [429, 403, 502])
+def test_non_success_status_counts_as_error(upstream, status):
+    upstream.hosts = {'a': (0, status), 'b': (0, 200)}
+    pool = make_pool('a', 'b')
+    
+    assert pool.get('/phim/x').status_code == 200
+    assert pool.stats()['https://a/v1/api']['errors'] == 1
+
+
+def test_not_found_is_a_valid_answer(upstream):
+    upstream.hosts = {'a': (0, 404), 'b': (0, 200)}
+    pool = make_pool('a', 'b')
+    
+    assert pool.get('/phim/missing').status_code == 404
+    assert [host for host, _ in upstream.calls] == ['a']
+
+
+def test_raises_last_error_when_every_mirror_fails(upstream):
+    upstream.hosts = {'a': (0, requests.ConnectionError('a down')), 'b': (0, requests.Timeout('b slow'))}
+    pool = make_pool('a', 'b')
+    
+    with pytest.raises(requests.Timeout):
+        pool.get('/phim/x')
+
+
+def test_routes_to_fastest_mirror(upstream):
+    upstream.hosts = {'a': (0.02, 200), 'b': (0, 200)}
+    pool = make_pool('a', 'b')
+    pool.probe_stale()
+    
+    assert [mirror.base_url for mirror in pool.ranked()] == ['https://b/v1/api', 'https://a/v1/api']
+
+
+def test_dead_mirror_is_only_probed_out_of_band(upstream):
+    upstream.hosts = {'a': (0, requests.ConnectionError('down')), 'b': (0, 200)}
+    pool = make_pool('a', 'b', probe_after=0.01, probe_timeout=1)
+    pool.get('/phim/x')
+    time.sleep(0.02)
+    upstream.calls.clear()
+    
+    pool.get('/phim/x')
+    assert [host for host, _ in upstream.calls] == ['b']
+    
+    upstream.calls.clear()
+    assert pool.probe_stale() == 1
+    assert upstream.calls == [('a', 1)]
+
+
+def test_failover_target_is_not_considered_stale(upstream):
+    upstream.hosts = {'a': (0, requests.ConnectionError('down')), 'b': (0, 200)}
+    pool = make_pool('a', 'b', probe_after=60)
+    pool.get('/phim/x')
+    upstream.calls.clear()
+    
+    assert pool.probe_stale() == 0
+    assert upstream.calls == []
+
+
+def test_hedges_to_backup_when_primary_exceeds_p95(upstream):
+    upstream.hosts = {'a': (0, 200), 'b': (0.001, 200)}
+    pool = make_pool('a', 'b', hedge=True)
+    for _ in range(25):
+        pool.get('/phim/x')
+    
+    upstream.hosts['a'] = (0.5, 200)
+    started = time.monotonic()
+    pool.get('/phim/x')
+    
+    assert time.monotonic() - started < 0.4
+    assert [host for host, _ in upstream.calls[-2:]] == ['a', 'b']
+
+
+def test_stops_when_request_budget_is_spent(upstream):
+    upstream.hosts = {'a': (0, requests.ConnectionError('down')), 'b': (0, 200)}
+    pool = make_pool('a', 'b')
+    budget = {'used': 0, 'limit': 1}
+    token = request_budget.set(budget)
+    try:
+        with pytest.raises(requests.RequestException):
+            pool.get('/phim/x')
+        with pytest.raises(requests.RequestException):
+            pool.get('/phim/x')
+    finally:
+        request_budget.reset(token)
+    
+    assert [host for host, _ in upstream.calls] == ['a']
+    assert budget['used'] == 1
+
+
+def test_requires_at_least_one_mirror():
+    with pytest.raises(ValueError):
+        MirrorPool([])
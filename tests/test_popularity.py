@@ -0,0 +1,147 @@
+import asyncio
+
+import pytest
+import requests
+
+import bot
+from bot import PopularityTracker
+
+
+def test_top_orders_by_count():
+    tracker = PopularityTracker()
+    for key, hits in [('a', 3), ('b', 5), ('c', 1)]:
+        for _ in range(hits):
+            tracker.record(('movie', key))
+    
+    assert [key for key, _ in tracker.top(2)] == [('movie', 'b'), ('movie', 'a')]
+
+
+def test_full_candidate_list_evicts_coldest():
+    tracker = PopularityTracker(capacity=2)
+    for key, hits in [('a', 3), ('b', 1), ('c', 2)]:
+        for _ in range(hits):
+            tracker.record(('movie', key))
+    
+    assert {key for key, _ in tracker.top(5)} == {('movie', 'a'), ('movie', 'c')}
+
+
+def test_decay_drops_candidates_below_min_count():
+    tracker = PopularityTracker(min_count=1.0)
+    tracker.record(('search', 'typo'))
+    for _ in range(4):
+        tracker.record(('movie', 'hot'))
+    
+    tracker.decay(0.5)
+    assert [key for key, _ in tracker.top(5)] == [('movie', 'hot')]
+    assert tracker.estimate(('movie', 'hot')) == pytest.approx(2.0)
+    
+    for _ in range(24):
+        tracker.decay(0.5)
+    assert tracker.top(5) == []
+
+
+def test_forget_and_seed():
+    tracker = PopularityTracker(capacity=2)
+    tracker.record(('movie', 'a'))
+    tracker.forget(('movie', 'a'))
+    assert tracker.top(5) == []
+    
+    tracker.seed([('movie', 'x'), ('movie', 'y'), ('movie', 'z')])
+    assert {key for key, _ in tracker.top(5)} == {('movie', 'x'), ('movie', 'y')}
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self.payload = payload
+    
+    def json(self):
+        return self.payload
+
+
+class FakeOphim:
+    """Giả lập API Ophim: mỗi danh mục có 3 phim, tìm kiếm không có kết quả"""
+    def __init__(self):
+        self.down = False
+        self.calls = []
+    
+    def get(self, url, params=None, headers=None, timeout=None):
+        path = url.split('/v1/api', 1)[1]
+        self.calls.append(path)
+        if self.down:
+            raise requests.ConnectionError('upstream down')
+        
+        if path.startswith('/danh-sach/'):
+            slug = path.rsplit('/', 1)[1]
+            items = [{'slug': f'{slug}-{index}', 'name': f'{slug} {index}'} for index in range(3)]
+            return FakeResponse(200, {'status': 'success', 'data': {'items': items}})
+        if path == '/tim-kiem':
+            return FakeResponse(200, {'status': 'success', 'data': {'items': []}})
+        if path.startswith('/phim/'):
+            slug = path.rsplit('/', 1)[1]
+            if slug.startswith('khong-co'):
+                return FakeResponse(404)
+            return FakeResponse(200, {'status': 'success', 'data': {'item': {'slug': slug}}})
+        return FakeResponse(404)
+
+
+@pytest.fixture
+def movie_bot(monkeypatch):
+    upstream = FakeOphim()
+    monkeypatch.setattr(bot, 'BOT_TOKEN', '123456:TEST')
+    monkeypatch.setattr(bot.requests, 'get', upstream.get)
+    movie_bot = bot.MovieBot()
+    movie_bot.upstream = upstream
+    return movie_bot
+
+
+def warm(movie_bot):
+    asyncio.run(movie_bot.warm_cache(None))
+
+
+def test_cold_start_seeds_new_releases_from_category_pages(movie_bot):
+    warm(movie_bot)
+    
+    seeded = [key for key, _ in movie_bot.popularity.top(bot.WARM_TOP_K)]
+    assert ('movie', 'phim-moi-cap-nhat-0') in seeded
+    assert ('movie', 'phim-le-0') in seeded
+    assert ('movie', 'phim-moi-cap-nhat-0') in movie_bot.cache
+    assert movie_bot.warm_stats['last_requests'] == len(movie_bot.upstream.calls) <= bot.WARM_BUDGET
+
+
+def test_upstream_outage_keeps_hot_keys(movie_bot):
+    for _ in range(5):
+        movie_bot.popularity.record(('movie', 'hot'))
+    movie_bot.upstream.down = True
+    
+    warm(movie_bot)
+    assert ('movie', 'hot') in [key for key, _ in movie_bot.popularity.top(5)]
+    
+    movie_bot.upstream.down = False
+    warm(movie_bot)
+    assert ('movie', 'hot') in movie_bot.cache
+
+
+def test_outage_in_handler_path_keeps_key(movie_bot):
+    movie_bot.upstream.down = True
+    assert movie_bot.get_movie_details('hot') is None
+    assert movie_bot.search_movies_api('avengers') == []
+    
+    keys = [key for key, _ in movie_bot.popularity.top(5)]
+    assert ('movie', 'hot') in keys
+    assert ('search', 'avengers') in keys
+
+
+def test_empty_results_are_forgotten(movie_bot):
+    for _ in range(5):
+        movie_bot.popularity.record(('search', 'khong co phim'))
+        movie_bot.popularity.record(('movie', 'khong-co'))
+    
+    warm(movie_bot)
+    keys = [key for key, _ in movie_bot.popularity.top(bot.WARM_TOP_K)]
+    assert ('search', 'khong co phim') not in keys
+    assert ('movie', 'khong-co') not in keys
+    
+    movie_bot.upstream.calls.clear()
+    warm(movie_bot)
+    assert '/tim-kiem' not in movie_bot.upstream.calls
@@ -0,0 +1,172 @@
+import asyncio
+
+import pytest
+
+from bot import PriorityUpdateProcessor
+
+CALLBACK = PriorityUpdateProcessor.TIER_CALLBACK
+CACHED = PriorityUpdateProcessor.TIER_CACHED
+UPSTREAM = PriorityUpdateProcessor.TIER_UPSTREAM
+
+
+def make_processor(**kwargs):
+    """Processor có update là tuple (mức ưu tiên, tên)"""
+    kwargs.setdefault('workers', 2)
+    kwargs.setdefault('callback_reserved', 1)
+    kwargs.setdefault('starvation_timeout', 10)
+    return PriorityUpdateProcessor(lambda update: update[0], **kwargs)
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 5))
+
+
+async def record(order, update, gate=None):
+    if gate is not None:
+        await gate.wait()
+    order.append(update[1])
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_tiers_run_in_priority_order():
+    async def scenario():
+        processor = make_processor()
+        order = []
+        gate = asyncio.Event()
+        holder = asyncio.create_task(processor.process_update((UPSTREAM, 'holder'), record(order, (UPSTREAM, 'holder'), gate)))
+        await settle()
+        
+        tasks = [
+            asyncio.create_task(processor.process_update(update, record(order, update)))
+            for update in [(UPSTREAM, 'upstream'), (CACHED, 'cached')]
+        ]
+        await settle()
+        assert order == []
+        
+        gate.set()
+        await asyncio.gather(holder, *tasks)
+        return order
+    
+    assert run(scenario()) == ['holder', 'cached', 'upstream']
+
+
+def test_callback_uses_reserved_slot_while_searches_hold_the_rest():
+    async def scenario():
+        processor = make_processor(workers=3, callback_reserved=1)
+        order = []
+        gate = asyncio.Event()
+        searches = [
+            asyncio.create_task(processor.process_update(update, record(order, update, gate)))
+            for update in [(UPSTREAM, 's1'), (UPSTREAM, 's2'), (UPSTREAM, 's3')]
+        ]
+        await settle()
+        stats = processor.stats()
+        assert stats['upstream']['running'] == 2
+        assert stats['upstream']['depth'] == 1
+        
+        callback = (CALLBACK, 'click')
+        await processor.process_update(callback, record(order, callback))
+        assert order == ['click']
+        
+        gate.set()
+        await asyncio.gather(*searches)
+        return processor.stats()
+    
+    stats = run(scenario())
+    assert stats['running'] == 0
+    assert stats['upstream']['dispatched'] == 3
+
+
+def test_starving_update_is_promoted():
+    async def scenario():
+        processor = make_processor(starvation_timeout=0.05)
+        order = []
+        gate = asyncio.Event()
+        holder = asyncio.create_task(processor.process_update((UPSTREAM, 'holder'), record(order, (UPSTREAM, 'holder'), gate)))
+        await settle()
+        
+        old = asyncio.create_task(processor.process_update((UPSTREAM, 'old'), record(order, (UPSTREAM, 'old'))))
+        await asyncio.sleep(0.1)
+        new = asyncio.create_task(processor.process_update((CACHED, 'new'), record(order, (CACHED, 'new'))))
+        await settle()
+        
+        gate.set()
+        await asyncio.gather(holder, old, new)
+        return order, processor.stats()
+    
+    order, stats = run(scenario())
+    assert order == ['holder', 'old', 'new']
+    assert stats['upstream']['promoted'] == 1
+
+
+def test_cancel_while_queued_frees_nothing_and_keeps_queue_moving():
+    async def scenario():
+        processor = make_processor()
+        order = []
+        gate = asyncio.Event()
+        holder = asyncio.create_task(processor.process_update((UPSTREAM, 'holder'), record(order, (UPSTREAM, 'holder'), gate)))
+        await settle()
+        
+        cancelled = asyncio.create_task(processor.process_update((UPSTREAM, 'cancelled'), record(order, (UPSTREAM, 'cancelled'))))
+        waiting = asyncio.create_task(processor.process_update((UPSTREAM, 'waiting'), record(order, (UPSTREAM, 'waiting'))))
+        await settle()
+        cancelled.cancel()
+        await settle()
+        assert processor.stats()['upstream']['depth'] == 1
+        
+        gate.set()
+        await asyncio.gather(holder, waiting)
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        return order, processor.stats()
+    
+    order, stats = run(scenario())
+    assert order == ['holder', 'waiting']
+    assert stats['running'] == 0
+    assert stats['upstream']['depth'] == 0
+
+
+@pytest.mark.parametrize('cancel_first', [True, False])
+def test_cancel_in_same_step_as_handoff_does_not_leak_slot(cancel_first):
+    async def scenario():
+        processor = make_processor()
+        order = []
+        # Giữ slot không dành riêng bằng tay để có thể nhường slot đồng bộ
+        await processor._acquire(UPSTREAM)
+        
+        queued = asyncio.create_task(processor.process_update((UPSTREAM, 'queued'), record(order, (UPSTREAM, 'queued'))))
+        await settle()
+        
+        if cancel_first:
+            queued.cancel()
+            processor._release(UPSTREAM)
+        else:
+            processor._release(UPSTREAM)
+            queued.cancel()
+        
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        
+        after = (UPSTREAM, 'after')
+        await processor.process_update(after, record(order, after))
+        return order, processor.stats()
+    
+    order, stats = run(scenario())
+    assert order == ['after']
+    assert stats['running'] == 0
+    assert stats['upstream']['depth'] == 0
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'workers': 1},
+    {'workers': 2, 'callback_reserved': 0},
+    {'workers': 2, 'callback_reserved': 2},
+    {'workers': 4, 'max_pending': 3},
+])
+def test_rejects_configurations_without_priorities(kwargs):
+    with pytest.raises(ValueError):
+        make_processor(**kwargs)